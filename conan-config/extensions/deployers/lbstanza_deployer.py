@@ -1,34 +1,212 @@
-
 # Conan L.B.Stanza Deployer
 # https://docs.conan.io/2/reference/extensions/deployers.html
 # https://docs.conan.io/2/examples/extensions/deployers/sources/custom_deployer_sources.html
 
-from shutil import copytree
 #from conans.errors import ConanException
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from shutil import copy2
+import hashlib
+import importlib.util
+import json
 import os
 
-# lbstanza_deployer function
-def deploy(graph, output_folder: str, **kwargs):
-    graph.root.conanfile.output.trace("---- lbstanza_deployer deploy() ----")
+# The deploy is incremental: a manifest in the deps directory records each deployed file,
+# and files whose source is unchanged since the last deploy are skipped.
+MANIFEST_NAME = ".lbstanza-deploy-manifest.json"
+MANIFEST_VERSION = 2
 
-    # for each dependency
-    for name, dep in graph.root.conanfile.dependencies.items():
-        # copy files to this directory
-        outdir = Path(output_folder)/'deps'
+# Environment variables that control the deploy:
+# LBSTANZA_DEPLOY_LINKS=1 hardlinks files from the conan cache where they cannot be reflinked,
+#   instead of copying them. A hardlinked file shares its inode, and its permissions, with the
+#   conan cache, so it is left as it is, and the build must not modify it.
+# LBSTANZA_DEPLOY_JOBS sets the number of files deployed in parallel.
+LINKS_ENV = "LBSTANZA_DEPLOY_LINKS"
+JOBS_ENV = "LBSTANZA_DEPLOY_JOBS"
+
+# The deploy is recorded as a phase of the build trace by a copy of conan_lbstanza_generator/build_trace.py
+# that ships next to this deployer. The leading underscore keeps conan from treating it as a deployer.
+BUILD_TRACE_MODULE = "_build_trace.py"
+
+# ioctl request to clone a file on copy-on-write filesystems (linux FICLONE)
+FICLONE = 0x40049409
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_stat(path: Path) -> list:
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
 
+
+def load_manifest(manifest_path: Path) -> dict:
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+
+def save_manifest(manifest_path: Path, files: dict):
+    tmp = manifest_path.with_suffix(".tmp")
+    with open(tmp, 'w') as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, f, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path)
+
+
+def reflink(src: Path, dst: Path) -> bool:
+    # clone the file without copying its data, if the filesystem supports it
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        dst.unlink(missing_ok=True)
+        return False
+
+
+def place_file(src: Path, dst: Path, use_links: bool) -> str:
+    # returns how the file was placed: "reflink", "hardlink" or "copy"
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    dst.unlink(missing_ok=True)
+    # a reflink is an independent copy, so it is always preferred
+    if reflink(src, dst):
+        return "reflink"
+    if use_links:
+        try:
+            # no chmod: it would change the file in the conan cache too
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            dst.unlink(missing_ok=True)
+    copy2(src, dst)
+    return "copy"
+
+
+def plan_files(graph, outdir: Path) -> dict:
+    # map each destination file, relative to outdir, to its source file
+    # later dependencies replace files of earlier ones, as in successive copytree calls
+    plan = {}
+    for name, dep in graph.root.conanfile.dependencies.items():
         # if the dependency is a library
         if (dep.package_type=='static-library' or dep.package_type=='shared-library'
                 or dep.package_type=='header-library') and (dep.package_path).exists():
-            incsrc = dep.package_path/'include'
-            incdst = outdir/'include'
-            libsrc = dep.package_path/'lib'
-            libdst = outdir/'lib'
-            if incsrc.exists():
-                incdst.mkdir(parents=True, exist_ok=True)
-                graph.root.conanfile.output.trace(f"  copying dependency include directory {incsrc} to {incdst}")
-                copytree(incsrc, incdst, dirs_exist_ok=True)
-            if libsrc.exists():
-                libdst.mkdir(parents=True, exist_ok=True)
-                graph.root.conanfile.output.trace(f"  copying dependency lib directory {libsrc} to {libdst}")
-                copytree(libsrc, libdst, dirs_exist_ok=True)
+            for subdir in ['include', 'lib']:
+                srcdir = dep.package_path/subdir
+                if srcdir.exists():
+                    graph.root.conanfile.output.trace(f"  deploying dependency {subdir} directory {srcdir} to {outdir/subdir}")
+                    for root, dirs, files in os.walk(srcdir, followlinks=True):
+                        for f in files:
+                            src = Path(root)/f
+                            plan[(Path(subdir)/src.relative_to(srcdir)).as_posix()] = src
+    return plan
+
+
+def deploy_file(rel: str, src: Path, outdir: Path, previous: dict, use_links: bool):
+    # returns the manifest entry of the deployed file, and how it was placed
+    dst = outdir/rel
+    src_stat = file_stat(src)
+    entry = previous.get(rel)
+    # a hardlink from a deploy with links is replaced by a copy when links are disabled
+    if entry and entry.get("hardlink") and not use_links:
+        entry = None
+    if entry and dst.exists() and file_stat(dst) == entry["dst_stat"]:
+        # unchanged source: skip without reading the file
+        if entry["src"] == str(src) and entry["src_stat"] == src_stat:
+            return entry, "unchanged"
+        # same content from a different source or with a new timestamp
+        digest = file_hash(src)
+        if digest == entry["hash"]:
+            return dict(entry, src=str(src), src_stat=src_stat), "unchanged"
+    else:
+        digest = file_hash(src)
+    how = place_file(src, dst, use_links)
+    return {"src": str(src), "src_stat": src_stat, "hash": digest, "dst_stat": file_stat(dst),
+            "hardlink": how == "hardlink"}, how
+
+
+def remove_stale_files(outdir: Path, stale: list[str]):
+    dirs = set()
+    for rel in stale:
+        p = outdir/rel
+        p.unlink(missing_ok=True)
+        dirs.update(p.parents)
+    # remove directories left empty, deepest first
+    for d in sorted(dirs, key=lambda d: len(d.parts), reverse=True):
+        if d != outdir and outdir in d.parents:
+            try:
+                d.rmdir()
+            except OSError:
+                pass
+
+
+def load_build_trace():
+    # conan loads this file by path, so the module next to it is loaded by path too
+    path = Path(__file__).with_name(BUILD_TRACE_MODULE)
+    if not path.exists():
+        return None
+    spec = importlib.util.spec_from_file_location("lbstanza_build_trace", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+build_trace = load_build_trace()
+
+
+def trace_phase(name: str):
+    # the deploy is not recorded if _build_trace.py is not installed
+    if build_trace is None:
+        return nullcontext({})
+    return build_trace.phase(name, cat="deployer")
+
+
+# lbstanza_deployer function
+def deploy(graph, output_folder: str, **kwargs):
+    output = graph.root.conanfile.output
+    output.trace("---- lbstanza_deployer deploy() ----")
+    with trace_phase("lbstanza_deployer deploy()") as trace_args:
+        files, stale, counts = deploy_files(graph, output_folder)
+        trace_args.update(files=len(files), stale=len(stale), **counts)
+
+
+def deploy_files(graph, output_folder: str):
+    # returns the manifest entries of the deployed files, the stale files removed, and the counts of how files were placed
+    output = graph.root.conanfile.output
+
+    # copy files to this directory
+    outdir = Path(output_folder)/'deps'
+    outdir.mkdir(parents=True, exist_ok=True)
+    manifest_path = outdir/MANIFEST_NAME
+    previous = load_manifest(manifest_path)
+    use_links = os.environ.get(LINKS_ENV, "0") == "1"
+    jobs = int(os.environ.get(JOBS_ENV, "0")) or min(32, (os.cpu_count() or 1) * 4)
+
+    plan = plan_files(graph, outdir)
+    files = {}
+    counts = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {rel: pool.submit(deploy_file, rel, src, outdir, previous, use_links) for rel, src in plan.items()}
+        for rel, future in futures.items():
+            files[rel], how = future.result()
+            counts[how] = counts.get(how, 0) + 1
+
+    stale = [rel for rel in previous if rel not in plan]
+    remove_stale_files(outdir, stale)
+    save_manifest(manifest_path, files)
+    output.trace(f"  deployed {len(plan)} files to {outdir}: {counts}, {len(stale)} stale files removed")
+    return files, stale, counts
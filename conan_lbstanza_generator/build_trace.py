@@ -0,0 +1,150 @@
+# Build Phase Timing
+# Records the wall and cpu time of the build phases as Chrome trace events.
+# https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+#
+# Events are appended as json lines to the file named by the LBSTANZA_BUILD_TRACE environment variable,
+# so that the Makefile, the conan recipe, the generator and the deployer all record into the same file.
+# Recording is disabled when the variable is not set.
+# This module is the only writer of the events: the deployer cannot import it from this package,
+# so a copy ships next to the deployer as conan-config/extensions/deployers/_build_trace.py
+# (the leading underscore keeps conan from listing it as a deployer). The Makefile checks that they match.
+#
+# Usage from the Makefile:
+#   python build_trace.py begin <name>            start a phase of the calling shell
+#   python build_trace.py end <name>              end a phase of the calling shell
+#   python build_trace.py run <name> -- <cmd>...  run a command as a phase
+#   python build_trace.py report [<trace.json>]   write the Chrome trace file and print a summary table
+
+from contextlib import contextmanager
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+TRACE_ENV = "LBSTANZA_BUILD_TRACE"
+
+
+def trace_file() -> str | None:
+    return os.environ.get(TRACE_ENV) or None
+
+
+def children_cpu_time() -> float:
+    # cpu time of the terminated child processes, which is not available on windows
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def record(event: dict):
+    path = trace_file()
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # a single append per event, so that concurrent writers do not interleave
+    with open(path, 'a') as f:
+        f.write(json.dumps(event) + "\n")
+
+
+@contextmanager
+def phase(name: str, cat: str = "build", **args):
+    # record the wall time and the cpu time of this process and its children spent in the with block
+    # yields the args of the event, to which the with block can add its results
+    if not trace_file():
+        yield args
+        return
+    start = time.time()
+    cpu = time.process_time()
+    child_cpu = children_cpu_time()
+    try:
+        yield args
+    finally:
+        record({
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": int((time.time() - start) * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": dict(args,
+                         cpu_s=round(time.process_time() - cpu, 6),
+                         child_cpu_s=round(children_cpu_time() - child_cpu, 6)),
+        })
+
+
+def load_events(path: str) -> list[dict]:
+    events = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                events.append(json.loads(line))
+    return events
+
+
+def complete_events(events: list[dict]) -> list[dict]:
+    # pair the begin and end events of the Makefile phases into complete events
+    result = [e for e in events if e["ph"] == "X"]
+    open_phases = {}
+    for e in events:
+        key = (e["pid"], e["name"])
+        if e["ph"] == "B":
+            open_phases[key] = e
+        elif e["ph"] == "E" and key in open_phases:
+            b = open_phases.pop(key)
+            result.append(dict(b, ph="X", dur=e["ts"] - b["ts"], args={}))
+    return sorted(result, key=lambda e: e["ts"])
+
+
+def summary(events: list[dict]) -> str:
+    # total wall and cpu time of each phase, slowest first
+    totals = {}
+    for e in complete_events(events):
+        t = totals.setdefault((e["cat"], e["name"]), [0, 0.0, 0.0])
+        t[0] += 1
+        t[1] += e["dur"] / 1e6
+        t[2] += e["args"].get("cpu_s", 0.0) + e["args"].get("child_cpu_s", 0.0)
+    rows = sorted(totals.items(), key=lambda r: r[1][1], reverse=True)
+    width = max([len(name) for (cat, name), t in rows] + [5])
+    lines = [f"{'phase':<{width}}  {'category':<10} {'count':>5} {'wall s':>9} {'cpu s':>9}"]
+    for (cat, name), (count, wall, cpu) in rows:
+        lines.append(f"{name:<{width}}  {cat:<10} {count:>5} {wall:>9.3f} {cpu:>9.3f}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) < 2:
+        print("usage: build_trace.py begin|end|run|report ...", file=sys.stderr)
+        return 2
+    command = argv[1]
+    if command in ("begin", "end"):
+        # the phase belongs to the calling shell, so that its begin and end events pair up
+        record({"name": argv[2], "cat": "make", "ph": "B" if command == "begin" else "E",
+                "ts": int(time.time() * 1e6), "pid": os.getppid(), "tid": 0})
+        return 0
+    if command == "run":
+        name = argv[2]
+        cmd = argv[4:] if argv[3:4] == ["--"] else argv[3:]
+        with phase(name, cat="make"):
+            return subprocess.run(cmd).returncode
+    if command == "report":
+        path = trace_file()
+        if not path or not os.path.exists(path):
+            return 0
+        events = load_events(path)
+        output = argv[2] if len(argv) > 2 else os.path.splitext(path)[0] + ".json"
+        with open(output, 'w') as f:
+            json.dump({"traceEvents": complete_events(events), "displayTimeUnit": "ms"}, f)
+        print(f"\n*** build phase timing (trace events in {output}) ***")
+        print(summary(events))
+        return 0
+    print(f"build_trace.py: unknown command \"{command}\"", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -9,40 +9,97 @@ from conans.model.pkg_type import PackageType
 from conans.model.build_info import _Component
 from io import TextIOWrapper
 from pathlib import Path
-import jsons
+import hashlib
+import json
+
+# recipes use these modules through this python_requires package
+from build_trace import phase
+from slm_manifest import load_manifest, stanza_name
+import startup_time
+
+# The first line of each generated fragment records the hash of the inputs it was generated from.
+# Bump the version when the generated output changes, so that existing fragments are regenerated.
+FRAGMENT_HASH_PREFIX = "; lbstanza-generator-hash: "
+FRAGMENT_FORMAT_VERSION = 2
+
+# Link time optimization of the static libraries is enabled with the "user.lbstanza:lto" conf.
+# The dependencies must have been built with -flto too, e.g. with the "tools.build:cflags" conf.
+LTO_CONF = "user.lbstanza:lto"
 
 # LBStanza Generator class
 class LBStanzaGenerator:
 
     def __init__(self, conanfile):
         self._conanfile = conanfile
-
-    def get_libs_from_component(self, compname: str, compinst: _Component) -> dict[str, str]:
+        self._trace_enabled = self.trace_enabled()
+
+    @staticmethod
+    def trace_enabled() -> bool:
+        try:
+            from conan.api.output import ConanOutput, LEVEL_TRACE
+            return ConanOutput.level_allowed(LEVEL_TRACE)
+        except (ImportError, AttributeError):
+            return True
+
+    def trace(self, msg: str, *args):
+        # format the message only when trace output is enabled
+        if self._trace_enabled:
+            self._conanfile.output.trace(msg % args if args else msg)
+
+    @staticmethod
+    def find_libdir(lib: str, libdirs: list[str], is_shared_lib: bool) -> Path:
+        # the libdir that contains the library, for packages with more than one libdir
+        if is_shared_lib:
+            filenames = [f"lib{lib}.so", f"lib{lib}.dylib", f"lib{lib}.dll.a", f"lib{lib}.dll", f"{lib}.dll"]
+        else:
+            filenames = [f"lib{lib}.a", f"{lib}.lib"]
+        for d in libdirs:
+            if any((Path(d) / f).exists() for f in filenames):
+                return Path(d)
+        return Path(libdirs[0])
+
+    def get_libs_from_component(self, compname: str, compinst: _Component, is_shared_lib: bool) -> dict[str, str]:
         #breakpoint()
-        self._conanfile.output.trace(f"      - {compname}")
+        self.trace("      - %s", compname)
 
-        reqlibdir = compinst.libdir
-        self._conanfile.output.trace(f"        - libdir = {reqlibdir}")
+        self.trace("        - libdirs = %s", compinst.libdirs)
+        if not compinst.libdirs:
+            self._conanfile.output.error(f"Component \"{compname}\" defined libs with no libdirs")
+            return {}
 
-        self._conanfile.output.trace(f"        - libs:")
+        self.trace("        - libs:")
         libdict = {}
         for l in compinst.libs:
-            self._conanfile.output.trace(f"          - {l}")
+            self.trace("          - %s", l)
 
-            libdict[l] = Path(reqlibdir)
+            libdict[l] = self.find_libdir(l, compinst.libdirs, is_shared_lib)
 
         #breakpoint()
-        self._conanfile.output.trace(f"        - get_libs_from_component(\"{compname}\", inst) -> \"{libdict}\"")
+        self.trace("        - get_libs_from_component(\"%s\", inst) -> \"%s\"", compname, libdict)
         return libdict
 
-    def write_package_fragment(self, is_shared_lib: bool, include_dirs: list[str], libs: dict, outfilename: str):
-        self._conanfile.output.trace(f"  > write_package_fragment({is_shared_lib},")
-        self._conanfile.output.trace(f"      libs[\"linux\"] = \"{libs['linux']}\",")
-        self._conanfile.output.trace(f"      libs[\"macos\"] = \"{libs['macos']}\",")
-        self._conanfile.output.trace(f"      libs[\"windows\"] = \"{libs['windows']}\",")
-        self._conanfile.output.trace(f"      \"{outfilename}\")")
-        outerlibname = self._conanfile.name.removeprefix("slm-")
+    def fragment_is_current(self, outfilename: str, digest: str) -> bool:
+        # the fragment is current if it was generated from inputs with the same hash
+        try:
+            with open(outfilename, 'r') as f:
+                return f.readline().rstrip("\n") == f"{FRAGMENT_HASH_PREFIX}{digest}"
+        except OSError:
+            return False
+
+    def write_package_fragment(self, is_shared_lib: bool, include_dirs: list[str], libs: dict, link_flags: dict[str, list[str]], outfilename: str, digest: str):
+        self.trace("  > write_package_fragment(%s,", is_shared_lib)
+        self.trace("      libs[\"linux\"] = \"%s\",", libs['linux'])
+        self.trace("      libs[\"macos\"] = \"%s\",", libs['macos'])
+        self.trace("      libs[\"windows\"] = \"%s\",", libs['windows'])
+        self.trace("      link_flags = \"%s\",", link_flags)
+        self.trace("      \"%s\")", outfilename)
+        # leave an unchanged fragment untouched, so that its timestamp does not trigger rebuilds
+        if self.fragment_is_current(outfilename, digest):
+            self.trace("%s is up to date, skipping", outfilename)
+            return
+        outerlibname = stanza_name(self._conanfile.name)
         with open(outfilename, 'w') as outf:
+            outf.write(f"{FRAGMENT_HASH_PREFIX}{digest}\n")
             # look for a file called "template-stanza-{outerlibname}.proj", and include its contents if it exists.
             # this is because all "package requires" statements for a stanza package must be in the same file.
             # and it's cleaner to include them in this file fragment rather than put these fragment contents into the top-level stanza.proj
@@ -50,7 +107,7 @@ class LBStanzaGenerator:
             package_requires_found = False
             package_tests_requires_found = False
             if Path(templatefile).exists():
-                self._conanfile.output.trace(f"Including contents of template file \"{templatefile}\"")
+                self.trace("Including contents of template file \"%s\"", templatefile)
                 with open(templatefile, 'r') as t:
                     for line in t:
                         # look for the package requires line so we can skip it later
@@ -60,68 +117,52 @@ class LBStanzaGenerator:
                             package_tests_requires_found = True
                         outf.write(line)
             else:
-                self._conanfile.output.trace(f"Optional template file \"{templatefile}\" does not exist")
-
-            # use --start-group and --end-group because we're not sure of the ordering of the libs
-            startgrp = " \"-Wl,--start-group\" "
-            endgrp = " \"-Wl,--end-group\" "
+                self.trace("Optional template file \"%s\" does not exist", templatefile)
 
-            # add some additional system libraries that are sometimes needed but are not in the conan recipe (?)
-            # TODO: make this list dynamic or move it outside of this generator
-            # FIXME: check the "frameworks" and "system_libs" entries in the conan datastructure
-            extralibslnx = " \"-lz\" \"-ldl\" "
-            extralibsmac = " \"-lz\" \"-Wl,-framework,CoreFoundation\" \"-Wl,-framework,SystemConfiguration\" \"-Wl,-framework,Security\" "
-            extralibswin = " \"-lz\" \"-lbcrypt\" \"-lcrypt32\" \"-lws2_32\" "
-
-            # note: use '\n' for line terminator on all platforms
-            if not package_requires_found:
-                outf.write(f'package {outerlibname} requires :\n')
+            # the libraries are listed in dependency order, each before the libraries it requires
             if is_shared_lib:
-                outf.write(f'  dynamic-libraries:\n')
+                # use --start-group and --end-group for the shared libraries, whose ordering is less strict
+                startgrp = " \"-Wl,--start-group\" "
+                endgrp = " \"-Wl,--end-group\" "
+            else:
+                startgrp = ""
+                endgrp = ""
+
+            def write_requires():
+                # note: use '\n' for line terminator on all platforms
+                if is_shared_lib:
+                    outf.write(f'  dynamic-libraries:\n')
+                    outf.write(f'    on-platform:\n')
+                    s = " ".join([f'"{str(p)}"' for p in libs["linux"]])
+                    outf.write(f'      linux: ( {s} )\n')
+                    s = " ".join([f'"{str(p)}"' for p in libs["macos"]])
+                    outf.write(f'      os-x: ( {s} )\n')
+                    s = " ".join([f'"{str(p)}"' for p in libs["windows"]])
+                    outf.write(f'      windows: ( {s} )\n')
+                else:  # static archives are linked into the executable through the ccflags
+                    pass
+                outf.write(f'  ccflags:\n')
                 outf.write(f'    on-platform:\n')
+                incdirall = ""
+                for incdir in include_dirs:
+                    incdirall += f" \"-I{incdir}\" "
+                # system libraries and frameworks from the conan packages, after the libraries that need them
+                extra = {os: " ".join([f'"{f}"' for f in flags]) for os, flags in link_flags.items()}
                 s = " ".join([f'"{str(p)}"' for p in libs["linux"]])
-                outf.write(f'      linux: ( {s} )\n')
+                outf.write(f'      linux: ( {incdirall} {startgrp} {s} {extra["linux"]} {endgrp} )\n')
                 s = " ".join([f'"{str(p)}"' for p in libs["macos"]])
-                outf.write(f'      os-x: ( {s} )\n')
+                outf.write(f'      os-x: ( {incdirall} {s} {extra["macos"]} )\n')
                 s = " ".join([f'"{str(p)}"' for p in libs["windows"]])
-                outf.write(f'      windows: ( {s} )\n')
-            else:  # static
-                pass
-            outf.write(f'  ccflags:\n')
-            outf.write(f'    on-platform:\n')
-            incdirall = ""
-            for incdir in include_dirs:
-                incdirall += f" \"-I{incdir}\" "
-            s = " ".join([f'"{str(p)}"' for p in libs["linux"]])
-            outf.write(f'      linux: ( {incdirall} {startgrp} {s} {extralibslnx} {endgrp} )\n')
-            s = " ".join([f'"{str(p)}"' for p in libs["macos"]])
-            outf.write(f'      os-x: ( {incdirall} {s} {extralibsmac} )\n')
-            s = " ".join([f'"{str(p)}"' for p in libs["windows"]])
-            outf.write(f'      windows: ( {incdirall} {startgrp} {s} {extralibswin} {endgrp} )\n')
+                outf.write(f'      windows: ( {incdirall} {startgrp} {s} {extra["windows"]} {endgrp} )\n')
 
+            if not package_requires_found:
+                outf.write(f'package {outerlibname} requires :\n')
+            write_requires()
             outf.write(f'\n')
 
             if not package_tests_requires_found:
                 outf.write(f'package {outerlibname}/tests requires :\n')
-            if is_shared_lib:
-                outf.write(f'  dynamic-libraries:\n')
-                outf.write(f'    on-platform:\n')
-                s = " ".join([f'"{str(p)}"' for p in libs["linux"]])
-                outf.write(f'      linux: ( {s} )\n')
-                s = " ".join([f'"{str(p)}"' for p in libs["macos"]])
-                outf.write(f'      os-x: ( {s} )\n')
-                s = " ".join([f'"{str(p)}"' for p in libs["windows"]])
-                outf.write(f'      windows: ( {s} )\n')
-            else:  # static
-                pass
-            outf.write(f'  ccflags:\n')
-            outf.write(f'    on-platform:\n')
-            s = " ".join([f'"{str(p)}"' for p in libs["linux"]])
-            outf.write(f'      linux: ( {incdirall} {startgrp} {s} {extralibslnx} {endgrp} )\n')
-            s = " ".join([f'"{str(p)}"' for p in libs["macos"]])
-            outf.write(f'      os-x: ( {incdirall} {s} {extralibsmac} )\n')
-            s = " ".join([f'"{str(p)}"' for p in libs["windows"]])
-            outf.write(f'      windows: ( {incdirall} {startgrp} {s} {extralibswin} {endgrp} )\n')
+            write_requires()
 
 
     def get_component_libs_from_dependency(self, depname: str, depinst: ConanFileInterface) -> list:
@@ -133,21 +174,43 @@ class LBStanzaGenerator:
 
         #self._conanfile.output.trace(f"    - depinst.cppinfo: \"{depinst.cpp_info.serialize()}\"")
         #self._conanfile.output.trace(f"    - depinst.cppinfo:")
-        #self._conanfile.output.trace(jsons.dumps(depinst.cpp_info.serialize(), jdkwargs={"indent": 2}))
+        #self._conanfile.output.trace(json.dumps(depinst.cpp_info.serialize(), indent=2))
         # collect required library definitions from dependencies
-        self._conanfile.output.trace(f"    - components:")
+        self.trace("    - components:")
         complist = []
-        for compname, compinst in depinst.cpp_info.get_sorted_components().items():
-            complist.append(self.get_libs_from_component(compname, compinst))
+        is_shared_lib = depinst.package_type is PackageType.SHARED
+        # components are sorted with the required ones first, link them after the ones that need them
+        for compname, compinst in reversed(depinst.cpp_info.get_sorted_components().items()):
+            if compinst.libs:
+                complist.append(self.get_libs_from_component(compname, compinst, is_shared_lib))
 
         #breakpoint()
-        self._conanfile.output.trace(f"    - get_component_libs_from_dependency(\"{depname}\", inst) -> \"{complist}\"")
+        self.trace("    - get_component_libs_from_dependency(\"%s\", inst) -> \"%s\"", depname, complist)
         return complist
 
-    def write_cpp_info_to_fragment(self, is_shared_lib: bool, include_dirs: list[str], libs: dict[str, Path]):
-        self._conanfile.output.trace(f"  > write_component_libs_to_fragment({is_shared_lib}, \"{libs}\"")
-        outerlibname = self._conanfile.name.removeprefix("slm-")
+    def inputs_digest(self, is_shared_lib: bool, include_dirs: list[str], libs: dict[str, Path], link_flags: dict[str, list[str]], graph: list[dict]) -> str:
+        # hash everything the fragments are generated from: the resolved dependencies and the template file
+        outerlibname = stanza_name(self._conanfile.name)
+        templatefile = Path(f"template-stanza-{outerlibname}.proj")
+        inputs = {
+            "format": FRAGMENT_FORMAT_VERSION,
+            "name": outerlibname,
+            "shared": is_shared_lib,
+            "include_dirs": [str(d) for d in include_dirs],
+            # a list, because the order of the libs matters
+            "libs": [[l, str(p)] for l, p in libs.items()],
+            "link_flags": link_flags,
+            "graph": graph,
+            "template": templatefile.read_text() if templatefile.exists() else None,
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def write_cpp_info_to_fragment(self, is_shared_lib: bool, include_dirs: list[str], libs: dict[str, Path], link_flags: dict[str, list[str]], graph: list[dict]):
+        self.trace("  > write_component_libs_to_fragment(%s, \"%s\"", is_shared_lib, libs)
+        outerlibname = stanza_name(self._conanfile.name)
         relative_path = Path(f"{{.}}/../{outerlibname}/lib")
+        digest = self.inputs_digest(is_shared_lib, include_dirs, libs, link_flags, graph)
+        self.trace("  inputs digest: %s", digest)
 
         # lfn["relative"]["linux"] = ["a", "b"]
         libfilenames: dict[str, dict[str, list[str]]] = {}
@@ -174,73 +237,114 @@ class LBStanzaGenerator:
             libfilenames["relative"]["windows"].append(relative_path / fwin)
 
         # debug output filenames
-        for os, td in libfilenames.items():
-            for tp, a in td.items():
-                self._conanfile.output.trace(f"  {tp}-{os}: {', '.join([str(p) for p in a])}")
+        if self._trace_enabled:
+            for os, td in libfilenames.items():
+                for tp, a in td.items():
+                    self.trace("  %s-%s: %s", tp, os, ', '.join([str(p) for p in a]))
 
         # Write stanza.proj fragment with full library paths for dependencies in conan cache
         outfilename = f"stanza-{outerlibname}.proj"
-        self._conanfile.output.trace(f"Generating {outfilename} for {outerlibname}")
-        self.write_package_fragment(is_shared_lib, include_dirs, libfilenames["full"], outfilename)
+        self.trace("Generating %s for %s", outfilename, outerlibname)
+        self.write_package_fragment(is_shared_lib, include_dirs, libfilenames["full"], link_flags, outfilename, digest)
 
         # Write stanza.proj fragment with relative library paths for dependencies in an slm package
         outfilename = f"stanza-{outerlibname}-relative.proj"
-        self._conanfile.output.trace(f"Generating {outfilename} for {outerlibname}")
-        self.write_package_fragment(is_shared_lib, [], libfilenames["relative"], outfilename)
+        self.trace("Generating %s for %s", outfilename, outerlibname)
+        self.write_package_fragment(is_shared_lib, [], libfilenames["relative"], link_flags, outfilename, digest)
+
+    def link_order(self) -> list:
+        # the dependencies, each before the dependencies it requires, which is the order static libraries are linked in
+        return list(reversed(self._conanfile.dependencies.host.topological_sort.items()))
+
+    def link_flags(self, is_shared_lib: bool, system_libs: list[str], frameworks: list[str], defines: list[str]) -> dict[str, list[str]]:
+        # the flags for the current platform, which is the one the fragments are generated and used on
+        flags = [f"-D{d}" for d in defines]
+        if not is_shared_lib and self._conanfile.conf.get(LTO_CONF, default=False, check_type=bool):
+            flags.append("-flto")
+        flags.extend([f"-l{l}" for l in system_libs])
+        return {
+            "linux": flags,
+            "macos": flags + [f"-Wl,-framework,{f}" for f in frameworks],
+            "windows": flags,
+        }
 
     def create_stanza_proj_fragment(self):
         incdirs = []
         libs = {}
         is_shared_lib = False
-        for dep in self._conanfile.dependencies.items():
+        # system libraries, frameworks and defines required by the dependencies, in link order
+        system_libs = []
+        frameworks = []
+        defines = []
+        # the resolved dependencies, used to detect when the fragments need to be regenerated
+        graph = []
+        for dep in self.link_order():
             dreq = dep[0]
             dinst = dep[1]
-            self._conanfile.output.trace(f"")
+            self.trace("")
             #self._conanfile.output.trace(f"  checking dep \"{dreq.serialize()}\"")
-            self._conanfile.output.trace(f"  - dependency: {dreq.ref}")
-            self._conanfile.output.trace(f"    - pref: {dinst.pref}")
-            self._conanfile.output.trace(f"    - package_type: {dinst.package_type}")
-            self._conanfile.output.trace(f"    - package_path: {dinst.package_path if dinst.package_folder else 'None'}")
+            self.trace("  - dependency: %s", dreq.ref)
+            self.trace("    - pref: %s", dinst.pref)
+            self.trace("    - package_type: %s", dinst.package_type)
+            self.trace("    - package_path: %s", dinst.package_path if dinst.package_folder else 'None')
 
             if not dreq.libs:
-                self._conanfile.output.trace(f"    - dep \"{dreq.ref}\" is not a lib, skipping")
+                self.trace("    - dep \"%s\" is not a lib, skipping", dreq.ref)
                 continue
+            graph.append({
+                "ref": str(dreq.ref),
+                "pref": str(dinst.pref),
+                "package_type": str(dinst.package_type),
+                "includedirs": [str(d) for d in dinst.cpp_info.includedirs],
+                "libdirs": [str(d) for d in dinst.cpp_info.libdirs],
+                "libs": list(dinst.cpp_info.libs),
+                "components": {name: {"libdirs": [str(d) for d in comp.libdirs], "libs": list(comp.libs)}
+                               for name, comp in dinst.cpp_info.components.items()},
+            })
+            infos = list(dinst.cpp_info.components.values()) if len(dinst.cpp_info.components) > 0 else [dinst.cpp_info]
+            for info in infos:
+                system_libs.extend([l for l in info.system_libs if l not in system_libs])
+                frameworks.extend([f for f in info.frameworks if f not in frameworks])
+                defines.extend([d for d in info.defines if d not in defines])
             if len(dinst.cpp_info.components) > 0:
-                self._conanfile.output.trace(f"    - dep \"{dreq.ref}\" components:")
+                self.trace("    - dep \"%s\" components:", dreq.ref)
                 is_shared_lib = dinst.package_type is PackageType.SHARED  # assumption: accept the last value because they should all be the same
                 for cl in self.get_component_libs_from_dependency(str(dreq.ref), dinst):
-                    self._conanfile.output.trace(f"    - dep \"{dreq.ref}\" component \"{cl}\"")
+                    self.trace("    - dep \"%s\" component \"%s\"", dreq.ref, cl)
                     # cl is a dictionary {name: path}
                     libs.update(cl)
             else:
-                self._conanfile.output.trace(f"    - dep \"{dreq.ref}\" include dirs: {dinst.cpp_info.includedirs}")
-                self._conanfile.output.trace(f"    - dep \"{dreq.ref}\" lib dirs: {dinst.cpp_info.libdirs}")
-                self._conanfile.output.trace(f"    - dep \"{dreq.ref}\" libs: {dinst.cpp_info.libs}")
+                self.trace("    - dep \"%s\" include dirs: %s", dreq.ref, dinst.cpp_info.includedirs)
+                self.trace("    - dep \"%s\" lib dirs: %s", dreq.ref, dinst.cpp_info.libdirs)
+                self.trace("    - dep \"%s\" libs: %s", dreq.ref, dinst.cpp_info.libs)
                 incdirs.extend(dinst.cpp_info.includedirs)
-                if len(dinst.cpp_info.libdirs) > 1:
-                    self._conanfile.output.error(f"Dependency \"{dreq.ref}\" has more than one libdir.  This generator currently doesn't handle that.")
                 if len(dinst.cpp_info.libdirs) > 0:
                     is_shared_lib = dinst.package_type is PackageType.SHARED  # assumption: accept the last value because they should all be the same
-                    libdir = dinst.cpp_info.libdirs[0]
                     d = {}
                     for l in dinst.cpp_info.libs:
-                        d[l] = libdir
+                        d[l] = self.find_libdir(l, dinst.cpp_info.libdirs, is_shared_lib)
                     # d is a dictionary {name: path}
                     libs.update(d)
                 else:
                     self._conanfile.output.error(f"Dependency \"{dreq.ref}\" defined libs with no libdirs")
 
-
-        self.write_cpp_info_to_fragment(is_shared_lib, incdirs, libs)
+        self.trace("  - system libs: %s", system_libs)
+        self.trace("  - frameworks: %s", frameworks)
+        self.trace("  - defines: %s", defines)
+        link_flags = self.link_flags(is_shared_lib, system_libs, frameworks, defines)
+        self.write_cpp_info_to_fragment(is_shared_lib, incdirs, libs, link_flags, graph)
 
     def generate(self):
-        self._conanfile.output.trace(f"---- LBStanzaGenerator.generate() ----")
+        self.trace("---- LBStanzaGenerator.generate() ----")
 
-        self.create_stanza_proj_fragment()
+        with phase("LBStanzaGenerator.generate()", cat="generator"):
+            self.create_stanza_proj_fragment()
 
-        self._conanfile.output.trace("----")
+        self.trace("----")
 
 class LBStanzaGeneratorPyReq(ConanFile):
     name = "lbstanzagenerator_pyreq"
     version = "0.1"
     package_type = "python-require"
+    # modules imported by the generator
+    exports = "build_trace.py", "slm_manifest.py", "startup_time.py"
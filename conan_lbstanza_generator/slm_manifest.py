@@ -0,0 +1,185 @@
+# slm.toml Manifest
+# Parses an slm.toml file once per process into a validated, immutable model
+# of the package name, version and conan dependencies.
+#
+# Usage from the Makefile:
+#   python slm_manifest.py [-f slm.toml] name               print the package name
+#   python slm_manifest.py [-f slm.toml] version            print the package version
+#   python slm_manifest.py [-f slm.toml] reference          print name/version
+#   python slm_manifest.py [-f slm.toml] requires           print the conan requires, one per line
+#   python slm_manifest.py [-f slm.toml] options [<pkg>]    print the options of the conan dependencies for this platform
+
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping
+import platform
+import sys
+import tomllib
+
+# the platform keys of platform-specific dependency options
+PLATFORMS = ("linux", "macos", "windows")
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def current_platform() -> str:
+    # get current platform, named as in slm.toml
+    psys = platform.system().lower()
+    if psys == "darwin":
+        psys = "macos"
+    return psys
+
+
+def stanza_name(name: str) -> str:
+    # the stanza package name of an slm package, without any "slm-" prefix
+    return name.removeprefix("slm-")
+
+
+@dataclass(frozen=True)
+class ConanDependency:
+    key: str
+    pkg: str
+    version: str
+    # options for all platforms, and options for a single platform which take precedence
+    common_options: Mapping[str, str]
+    platform_options: Mapping[str, Mapping[str, str]]
+
+    @property
+    def requires(self) -> str:
+        return f"{self.pkg}/{self.version}"
+
+    def options(self, psys: str | None = None) -> Mapping[str, str]:
+        # the options for the given platform, by default the current one
+        opts = dict(self.common_options)
+        opts.update(self.platform_options.get(psys or current_platform(), {}))
+        return MappingProxyType(opts)
+
+
+@dataclass(frozen=True)
+class SlmManifest:
+    path: Path
+    name: str
+    version: str
+    conan_dependencies: tuple[ConanDependency, ...]
+
+    @property
+    def stanza_name(self) -> str:
+        return stanza_name(self.name)
+
+    @property
+    def reference(self) -> str:
+        return f"{self.name}/{self.version}"
+
+    def conan_dependency(self, pkg: str) -> ConanDependency:
+        for d in self.conan_dependencies:
+            if d.pkg == pkg:
+                return d
+        raise ManifestError(f"{self.path}: no conan dependency \"{pkg}\"")
+
+
+def option_value(path: Path, where: str, k: str, v) -> str:
+    # conan options are strings, and slm.toml usually writes them as strings too
+    if isinstance(v, (str, bool, int, float)):
+        return str(v)
+    raise ManifestError(f"{path}: {where} option \"{k}\" must be a string, not {type(v).__name__}")
+
+
+def parse_conan_dependency(path: Path, key: str, d: dict) -> ConanDependency:
+    where = f"dependency \"{key}\""
+    for field in ("pkg", "version"):
+        if not isinstance(d.get(field), str):
+            raise ManifestError(f"{path}: {where} needs a string \"{field}\"")
+    opts = d.get("options", {})
+    if not isinstance(opts, dict):
+        raise ManifestError(f"{path}: {where} \"options\" must be a table")
+    common = {}
+    per_platform = {}
+    for k, v in opts.items():
+        # check for platform-specific options
+        if k in PLATFORMS:
+            if not isinstance(v, dict):
+                raise ManifestError(f"{path}: {where} \"options.{k}\" must be a table")
+            per_platform[k] = MappingProxyType({k2: option_value(path, where, k2, v2) for k2, v2 in v.items()})
+        else:
+            common[k] = option_value(path, where, k, v)
+    return ConanDependency(key, d["pkg"], d["version"], MappingProxyType(common), MappingProxyType(per_platform))
+
+
+def parse_manifest(path: Path, data: dict) -> SlmManifest:
+    for field in ("name", "version"):
+        if not isinstance(data.get(field), str) or not data[field]:
+            raise ManifestError(f"{path}: needs a non-empty string \"{field}\"")
+    deps = data.get("dependencies", {})
+    if not isinstance(deps, dict):
+        raise ManifestError(f"{path}: \"dependencies\" must be a table")
+    conan_deps = []
+    # for each dependency in slm.toml
+    for k, d in deps.items():
+        if not isinstance(d, dict):
+            raise ManifestError(f"{path}: dependency \"{k}\" must be a table")
+        # if it's a conan pkg dependency
+        if "pkg" in d and d.get("type") == "conan":
+            conan_deps.append(parse_conan_dependency(path, k, d))
+    return SlmManifest(path, data["name"], data["version"], tuple(conan_deps))
+
+
+@lru_cache(maxsize=None)
+def _load(path: Path, mtime_ns: int, size: int) -> SlmManifest:
+    with open(path, "rb") as f:
+        try:
+            data = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ManifestError(f"{path}: {e}") from e
+    return parse_manifest(path, data)
+
+
+def load_manifest(path: str | Path = "slm.toml") -> SlmManifest:
+    # parsed once per process, unless the file changes
+    path = Path(path).resolve()
+    try:
+        st = path.stat()
+    except OSError as e:
+        raise ManifestError(f"{path}: {e.strerror}") from e
+    return _load(path, st.st_mtime_ns, st.st_size)
+
+
+def main(argv: list[str]) -> int:
+    args = argv[1:]
+    path = "slm.toml"
+    if args[:1] == ["-f"] and len(args) > 1:
+        path = args[1]
+        args = args[2:]
+    if not args:
+        print("usage: slm_manifest.py [-f slm.toml] name|version|reference|requires|options [<pkg>]", file=sys.stderr)
+        return 2
+    try:
+        m = load_manifest(path)
+        if args[0] == "name":
+            print(m.name)
+        elif args[0] == "version":
+            print(m.version)
+        elif args[0] == "reference":
+            print(m.reference)
+        elif args[0] == "requires":
+            for d in m.conan_dependencies:
+                print(d.requires)
+        elif args[0] == "options":
+            deps = [m.conan_dependency(args[1])] if len(args) > 1 else m.conan_dependencies
+            for d in deps:
+                for k, v in d.options().items():
+                    print(f"{d.pkg}:{k}={v}")
+        else:
+            print(f"slm_manifest.py: unknown command \"{args[0]}\"", file=sys.stderr)
+            return 2
+    except ManifestError as e:
+        print(f"slm_manifest.py: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,72 @@
+# Startup Time
+# Measures the startup time of an executable, to compare the link modes of the same program.
+#
+# Usage:
+#   python startup_time.py measure <label> <runs> <output.json> -- <cmd>...  time <runs> runs of a command
+#   python startup_time.py compare <result.json>...                          print a comparison table
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def measure(label: str, cmd: list[str], runs: int = 50, env: dict | None = None) -> dict:
+    # the first run warms up the filesystem cache and is not counted
+    times = []
+    for i in range(runs + 1):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, check=True)
+        if i > 0:
+            times.append((time.perf_counter() - start) * 1000.0)
+    times.sort()
+    return {
+        "label": label,
+        "command": cmd,
+        "runs": runs,
+        "min_ms": times[0],
+        "median_ms": statistics.median(times),
+        "p90_ms": times[min(len(times) - 1, (len(times) * 90) // 100)],
+        "mean_ms": statistics.fmean(times),
+    }
+
+
+def save(result: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+def compare(results: list[dict]) -> str:
+    # relative to the first result
+    base = results[0]["median_ms"]
+    width = max([len(r["label"]) for r in results] + [5])
+    lines = [f"{'build':<{width}} {'runs':>5} {'min ms':>9} {'median ms':>10} {'p90 ms':>9} {'vs ' + results[0]['label']:>12}"]
+    for r in results:
+        lines.append(f"{r['label']:<{width}} {r['runs']:>5} {r['min_ms']:>9.2f} {r['median_ms']:>10.2f} {r['p90_ms']:>9.2f} {r['median_ms'] / base:>11.2f}x")
+    return "\n".join(lines)
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) > 5 and argv[1] == "measure":
+        label, runs, output = argv[2], int(argv[3]), argv[4]
+        cmd = argv[6:] if argv[5] == "--" else argv[5:]
+        result = measure(label, cmd, runs)
+        save(result, output)
+        print(compare([result]))
+        return 0
+    if len(argv) > 2 and argv[1] == "compare":
+        results = []
+        for path in argv[2:]:
+            with open(path, 'r') as f:
+                results.append(json.load(f))
+        print(compare(results))
+        return 0
+    print("usage: startup_time.py measure <label> <runs> <output.json> -- <cmd>... | compare <result.json>...", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -4,20 +4,43 @@ V=sys.version_info
 if V[0] < 3 or (V[0] == 3 and V[1] < 11):
   raise RuntimeError("Invalid Python Version - This script expects at least Python 3.11")
 
+import functools
+import hashlib
 import os
 import platform
-import tomllib
 from conan import ConanFile
 from conan.tools.build import can_run
 from conan.tools.files import copy
 from conan.tools.cmake import CMakeDeps, CMakeToolchain
 from conan.tools.env import VirtualBuildEnv
+from io import StringIO
 from pathlib import Path
-from shutil import copy2, copytree
+from shutil import copy2, copytree, rmtree
 
 
 required_conan_version = ">=2.0"
 
+# Compiled stanza packages are cached between builds, keyed on the sources, the compiler and the
+# dependency fragments. The cache directory can be set with the "user.slm:pkg_cache" conf,
+# and an empty value disables the cache.
+PKG_CACHE_DEFAULT = Path.home() / ".cache" / "slm-pkg-cache"
+PKG_CACHE_DIRS = [".slm/pkgs", ".slm/test-pkgs", ".slm/pkg-cache"]
+PKG_CACHE_ENTRIES = 5
+
+# The startup time of an executable using the package is measured when the "user.lbstanza:startup_report"
+# conf names a json file to write it to, so that the shared and static link modes can be compared.
+STARTUP_REPORT_CONF = "user.lbstanza:startup_report"
+STARTUP_RUNS_CONF = "user.lbstanza:startup_runs"
+
+
+# timed(): Records the wall and cpu time of a recipe method in the build trace
+def timed(method):
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    with self.python_requires["lbstanzagenerator_pyreq"].module.phase(f"conanfile.py: {method.__name__}()", cat="recipe"):
+      return method(self, *args, **kwargs)
+  return wrapper
+
 class ConanSlmPackage(ConanFile):
   package_type = "library"
   python_requires = "lbstanzagenerator_pyreq/[>=0.1]"
@@ -31,19 +54,22 @@ class ConanSlmPackage(ConanFile):
   implements = ["auto_shared_fpic"]
 
 
+  # slm_manifest(): The parsed slm.toml of this recipe, shared by all recipe methods
+  def slm_manifest(self):
+    return self.python_requires["lbstanzagenerator_pyreq"].module.load_manifest(os.path.join(self.recipe_folder, "slm.toml"))
+
+
   # set_name(): Dynamically define the name of a package
   def set_name(self):
     self.output.info("conanfile.py: set_name()")
-    with open(f"{self.recipe_folder}/slm.toml", "rb") as f:
-        self.name = tomllib.load(f)["name"]
+    self.name = self.slm_manifest().name
     self.output.info(f"conanfile.py: set_name() - self.name={self.name} from slm.toml")
 
 
   # set_version(): Dynamically define the version of a package.
   def set_version(self):
     self.output.info("conanfile.py: set_version()")
-    with open(f"{self.recipe_folder}/slm.toml", "rb") as f:
-        self.version = tomllib.load(f)["version"]
+    self.version = self.slm_manifest().version
     self.output.info(f"conanfile.py: set_version() - self.version={self.version} from slm.toml")
 
   # export(): Copies files that are part of the recipe
@@ -69,53 +95,26 @@ class ConanSlmPackage(ConanFile):
 
 
   # configure(): Allows configuring settings and options while computing dependencies
+  @timed
   def configure(self):
     self.output.info("conanfile.py: configure()")
 
-    with open(f"{self.recipe_folder}/slm.toml", "rb") as f:
-      deps = tomllib.load(f)["dependencies"]
-      # get current platform
-      psys = platform.system().lower()
-      if psys=="darwin":
-        psys = "macos"
-
-      # for each dependency in slm.toml
-      for k, d in deps.items():
-        # if it's a conan pkg dependency
-        if "pkg" in d.keys() and "type" in d.keys() and d["type"]=="conan":
-          # get its name and set any options
-          pkgname = d["pkg"]
-
-          if "options" in d.keys():
-            opts = d["options"]
-            for k, v in opts.items():
-              self.output.trace(f"conanfile.py: configure() options[\"{pkgname}\"].{k}={v}")
-              # check for platform-specific options
-              if k in ["linux", "macos", "windows"]:
-                # only apply our platform, skip others
-                if k==psys:
-                  for k2, v2 in v.items():
-                    self.options[pkgname]._set(k2,v2)
-              else:
-                self.options[pkgname]._set(k,v)
+    # for each conan pkg dependency in slm.toml, set the options for the current platform
+    for d in self.slm_manifest().conan_dependencies:
+      for k, v in d.options().items():
+        self.output.trace(f"conanfile.py: configure() options[\"{d.pkg}\"].{k}={v}")
+        self.options[d.pkg]._set(k, v)
 
 
   # requirements(): Define the dependencies of the package
+  @timed
   def requirements(self):
     self.output.info("conanfile.py: requirements()")
 
-    with open(f"{self.recipe_folder}/slm.toml", "rb") as f:
-      deps = tomllib.load(f)["dependencies"]
-
-      # for each dependency in slm.toml
-      for k, d in deps.items():
-        # if it's a conan pkg dependency
-        if "pkg" in d.keys() and "type" in d.keys() and d["type"]=="conan":
-          # use its name and version as a conan requires
-          pkgname = d["pkg"]
-          pkgver = d["version"]
-          self.output.trace(f"conanfile.py: requirements() requires(\"{pkgname}/{pkgver}\")")
-          self.requires(f"{pkgname}/{pkgver}")
+    # use the name and version of each conan pkg dependency in slm.toml as a conan requires
+    for d in self.slm_manifest().conan_dependencies:
+      self.output.trace(f"conanfile.py: requirements() requires(\"{d.requires}\")")
+      self.requires(d.requires)
 
 
   # build_requirements(): Defines tool_requires and test_requires
@@ -137,6 +136,7 @@ class ConanSlmPackage(ConanFile):
 
 
   # generate(): Generates the files that are necessary for building the package
+  @timed
   def generate(self):
     self.output.info("conanfile.py: generate()")
     lbsg = self.python_requires["lbstanzagenerator_pyreq"].module.LBStanzaGenerator(self).generate()
@@ -145,19 +145,126 @@ class ConanSlmPackage(ConanFile):
     #self.run("pwd ; ls -la", cwd=None, ignore_errors=False, env="", quiet=False, shell=True, scope="build")
 
 
+  # run(): Runs a command, recording its wall and cpu time in the build trace
+  def run(self, command, *args, **kwargs):
+    with self.python_requires["lbstanzagenerator_pyreq"].module.phase(command, cat="subprocess"):
+      return super().run(command, *args, **kwargs)
+
+
+  # tool_version(): Runs a tool's version command, and returns its output
+  def tool_version(self, cmd: str) -> str:
+    out = StringIO()
+    self.run(cmd, stdout=out, cwd=self.source_folder, scope="build")
+    self.output.info(out.getvalue().strip())
+    return out.getvalue()
+
+
+  # pkg_cache_key(): Hash everything the compiled stanza packages depend on
+  def pkg_cache_key(self, versions: list[str], skip_test: bool) -> str:
+    h = hashlib.sha256()
+    for v in versions + [str(self.settings.os), str(self.settings.arch), str(self.options.shared), str(skip_test)]:
+      h.update(v.encode())
+      h.update(b"\0")
+    # the sources, the project files, and the stanza.proj fragments of the resolved conan dependencies
+    src = Path(self.source_folder)
+    files = [src / "slm.toml", src / "slm.lock", src / "stanza.proj"]
+    files += sorted(src.glob("*stanza-*.proj"))
+    files += sorted(p for p in (src / "src").rglob("*") if p.is_file())
+    for f in files:
+      if f.is_file():
+        h.update(f.relative_to(src).as_posix().encode())
+        h.update(b"\0")
+        h.update(f.read_bytes())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+  # pkg_cache_entry(): The cache directory for a key, or None if the cache is disabled
+  def pkg_cache_entry(self, key: str):
+    cachedir = self.conf.get("user.slm:pkg_cache", default=str(PKG_CACHE_DEFAULT))
+    if not cachedir:
+      return None
+    return Path(cachedir) / self.name / key
+
+
+  # restore_pkg_cache(): Copy cached compiled packages into .slm, returns True on a cache hit
+  def restore_pkg_cache(self, entry: Path) -> bool:
+    if not entry.is_dir():
+      self.output.info(f"conanfile.py: build() - no compiled packages cached in {entry}")
+      return False
+    self.output.info(f"conanfile.py: build() - restoring compiled packages from {entry}")
+    for d in PKG_CACHE_DIRS:
+      cached = entry / Path(d).name
+      if cached.is_dir():
+        # copy2 keeps the timestamps, so that the restored packages are up to date
+        copytree(cached, os.path.join(self.source_folder, d), copy_function=copy2, dirs_exist_ok=True)
+    # mark the entry as recently used
+    os.utime(entry)
+    return True
+
+
+  # save_pkg_cache(): Copy the compiled packages from .slm into the cache
+  def save_pkg_cache(self, entry: Path):
+    self.output.info(f"conanfile.py: build() - caching compiled packages in {entry}")
+    # populate a temporary directory and rename it, so that a partial entry is never used
+    tmp = entry.with_name(f"{entry.name}.tmp-{os.getpid()}")
+    for d in PKG_CACHE_DIRS:
+      built = Path(self.source_folder) / d
+      if built.is_dir():
+        copytree(built, tmp / built.name, copy_function=copy2, dirs_exist_ok=True)
+    tmp.mkdir(parents=True, exist_ok=True)
+    try:
+      tmp.rename(entry)
+    except OSError:
+      # another build cached the same key
+      rmtree(tmp, ignore_errors=True)
+    # remove the least recently used entries
+    entries = sorted((p for p in entry.parent.iterdir() if p.is_dir() and ".tmp-" not in p.name),
+                     key=lambda p: p.stat().st_mtime, reverse=True)
+    for p in entries[PKG_CACHE_ENTRIES:]:
+      self.output.trace(f"conanfile.py: build() - removing cached packages {p}")
+      rmtree(p, ignore_errors=True)
+
+
+  # measure_startup(): Builds the startup executable, and writes its startup time to a json file
+  def measure_startup(self, report: str):
+    exe = "build/curl-startup.exe" if platform.system()=="Windows" else "build/curl-startup"
+    self.run(f"stanza build curl-startup -o {exe} -verbose", cwd=self.source_folder, scope="build")
+    # locate the built dlls at runtime, as for the tests
+    env = dict(os.environ)
+    runtime_path = {"Darwin": ("DYLD_LIBRARY_PATH", "dylib"), "Windows": ("PATH", "dll")}.get(platform.system())
+    if runtime_path:
+      var, ext = runtime_path
+      dirs = {str(p.resolve().parent) for p in Path(self.source_folder).glob(f"**/*.{ext}")}
+      env[var] = os.pathsep.join(sorted(dirs) + [env.get(var, "")])
+    shared = any(str(d.package_type)=="shared-library" for d in self.dependencies.host.values())
+    label = "shared" if shared else "static"
+    if self.conf.get("user.lbstanza:lto", default=False, check_type=bool):
+      label += "+lto"
+    startup_time = self.python_requires["lbstanzagenerator_pyreq"].module.startup_time
+    runs = self.conf.get(STARTUP_RUNS_CONF, default=50, check_type=int)
+    result = startup_time.measure(label, [os.path.join(self.source_folder, exe)], runs, env)
+    startup_time.save(result, report)
+    self.output.info(f"conanfile.py: build() - startup time written to {report}\n{startup_time.compare([result])}")
+
+
   # build(): Contains the build instructions to build a package from source
+  @timed
   def build(self):
     self.output.info("conanfile.py: build()")
     self.run("bash -c 'pwd ; ls -la'", cwd=self.source_folder, scope="build")
-    self.run("stanza version", cwd=self.source_folder, scope="build")
-    self.run("slm version", cwd=self.source_folder, scope="build")
+    versions = [self.tool_version("stanza version"), self.tool_version("slm version")]
+    skip_test = self.conf.get("tools.build:skip_test", default=False)
+    entry = self.pkg_cache_entry(self.pkg_cache_key(versions, skip_test))
+
     self.run("bash -c '[ ! -d .slm ] || slm clean'", cwd=self.source_folder, scope="build")
+    cached = entry is not None and self.restore_pkg_cache(entry)
     self.run("slm build -verbose -- -verbose", cwd=self.source_folder, scope="build")
 
-    if not self.conf.get("tools.build:skip_test", default=False):
+    if not skip_test:
       d="build"
       t="test"
-      self.run(f"stanza clean", cwd=self.source_folder, scope="build")
+      # the test build reuses the packages compiled by the main build
       self.run(f"stanza build {t} -o {d}/{t} -verbose", cwd=self.source_folder, scope="build")
       update_path_cmd=""
       if platform.system()=="Darwin":
@@ -180,11 +287,25 @@ class ConanSlmPackage(ConanFile):
           update_path_cmd=f"export PATH={path_str}:$PATH ; "
       self.run(f"bash -c '{update_path_cmd} {d}/{t}'",
                cwd=self.source_folder, scope="build")
+      # the HTTP tests, if any, need the POSIX loopback server, see stanza.proj
+      http_tests = f"{self.slm_manifest().stanza_name}-http-tests"
+      if platform.system()!="Windows" and f"build-test {http_tests} :" in Path(self.source_folder, "stanza.proj").read_text():
+        self.run(f"stanza build {http_tests} -o {d}/{http_tests} -verbose", cwd=self.source_folder, scope="build")
+        self.run(f"bash -c '{update_path_cmd} {d}/{http_tests}'",
+                 cwd=self.source_folder, scope="build")
+
+    startup_report = self.conf.get(STARTUP_REPORT_CONF, default=None)
+    if startup_report:
+      self.measure_startup(startup_report)
+
+    if entry is not None and not cached:
+      self.save_pkg_cache(entry)
 
   # package(): Copies files from build folder to the package folder.
+  @timed
   def package(self):
     self.output.info("conanfile.py: package()")
-    outerlibname = self.name.removeprefix("slm-")
+    outerlibname = self.slm_manifest().stanza_name
 
     copy2(os.path.join(self.source_folder, "slm.toml"), self.package_folder)
     #copy2(os.path.join(self.source_folder, "slm.lock"), self.package_folder)
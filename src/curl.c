@@ -1,11 +1,42 @@
 #include <curl/curl.h>
+#include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 
+#ifdef PLATFORM_WINDOWS
+  #include <winsock2.h>
+  #include <windows.h>
+  typedef CRITICAL_SECTION stz_mutex;
+  #define stz_mutex_init(m) InitializeCriticalSection(m)
+  #define stz_mutex_lock(m) EnterCriticalSection(m)
+  #define stz_mutex_unlock(m) LeaveCriticalSection(m)
+  #define stz_mutex_destroy(m) DeleteCriticalSection(m)
+  #define stz_fseek _fseeki64
+  #define stz_ftell _ftelli64
+  typedef WSAPOLLFD stz_pollfd;
+  #define stz_poll WSAPoll
+#else
+  #include <pthread.h>
+  #include <poll.h>
+  #include <time.h>
+  typedef pthread_mutex_t stz_mutex;
+  #define stz_mutex_init(m) pthread_mutex_init(m, NULL)
+  #define stz_mutex_lock(m) pthread_mutex_lock(m)
+  #define stz_mutex_unlock(m) pthread_mutex_unlock(m)
+  #define stz_mutex_destroy(m) pthread_mutex_destroy(m)
+  #define stz_fseek fseeko
+  #define stz_ftell ftello
+  typedef struct pollfd stz_pollfd;
+  #define stz_poll poll
+#endif
+
 // workaround for older versions of libcurl
 #ifndef CURL_SSLVERSION_TLSv1_3
   #define CURL_SSLVERSION_TLSv1_3 7
 #endif
+#ifndef CURL_HTTP_VERSION_3
+  #define CURL_HTTP_VERSION_3 30
+#endif
 
 #define GET_VAR(NAME) long get_ ## NAME (){return NAME;}
 GET_VAR(CURL_GLOBAL_ALL)
@@ -28,3 +59,412 @@ GET_VAR(CURL_SSLVERSION_TLSv1_1)
 GET_VAR(CURL_SSLVERSION_TLSv1_2)
 GET_VAR(CURL_SSLVERSION_TLSv1_3)
 GET_VAR(CURLOPT_CAINFO)
+GET_VAR(CURLOPT_HTTPGET)
+GET_VAR(CURLOPT_COPYPOSTFIELDS)
+GET_VAR(CURLOPT_NOPROGRESS)
+GET_VAR(CURLOPT_XFERINFOFUNCTION)
+GET_VAR(CURLOPT_XFERINFODATA)
+GET_VAR(CURL_WRITEFUNC_PAUSE)
+GET_VAR(CURLPAUSE_CONT)
+GET_VAR(CURLOPT_HEADERFUNCTION)
+GET_VAR(CURLOPT_HEADERDATA)
+GET_VAR(CURLINFO_CONTENT_LENGTH_DOWNLOAD_T)
+GET_VAR(CURLINFO_NAMELOOKUP_TIME_T)
+GET_VAR(CURLINFO_CONNECT_TIME_T)
+GET_VAR(CURLINFO_APPCONNECT_TIME_T)
+GET_VAR(CURLINFO_STARTTRANSFER_TIME_T)
+GET_VAR(CURLINFO_TOTAL_TIME_T)
+GET_VAR(CURLINFO_SIZE_DOWNLOAD_T)
+GET_VAR(CURLINFO_SPEED_DOWNLOAD_T)
+GET_VAR(CURLINFO_NUM_CONNECTS)
+GET_VAR(CURLOPT_HTTP_VERSION)
+GET_VAR(CURL_HTTP_VERSION_NONE)
+GET_VAR(CURL_HTTP_VERSION_1_0)
+GET_VAR(CURL_HTTP_VERSION_1_1)
+GET_VAR(CURL_HTTP_VERSION_2_0)
+GET_VAR(CURL_HTTP_VERSION_2TLS)
+GET_VAR(CURL_HTTP_VERSION_2_PRIOR_KNOWLEDGE)
+GET_VAR(CURL_HTTP_VERSION_3)
+GET_VAR(CURLOPT_PIPEWAIT)
+GET_VAR(CURLMOPT_PIPELINING)
+GET_VAR(CURLPIPE_MULTIPLEX)
+GET_VAR(CURLOPT_ACCEPT_ENCODING)
+GET_VAR(CURLOPT_SHARE)
+GET_VAR(CURL_LOCK_DATA_DNS)
+GET_VAR(CURL_LOCK_DATA_SSL_SESSION)
+GET_VAR(CURL_LOCK_DATA_CONNECT)
+GET_VAR(CURLOPT_NOBODY)
+GET_VAR(CURLOPT_RANGE)
+GET_VAR(CURLOPT_RESUME_FROM_LARGE)
+GET_VAR(CURLOPT_POST)
+GET_VAR(CURLOPT_POSTFIELDSIZE_LARGE)
+GET_VAR(CURLOPT_UPLOAD)
+GET_VAR(CURLOPT_INFILESIZE_LARGE)
+GET_VAR(CURLOPT_READFUNCTION)
+GET_VAR(CURLOPT_READDATA)
+GET_VAR(CURL_READFUNC_ABORT)
+GET_VAR(CURL_POLL_IN)
+GET_VAR(CURL_POLL_OUT)
+
+// Read the next finished transfer from a multi handle.
+// Returns 1 and fills in easy and result if a transfer has finished,
+// or returns 0 if there are no more finished transfers.
+int stz_multi_info_read (CURLM* multi, CURL** easy, int* result){
+  int queued;
+  CURLMsg* msg;
+  while((msg = curl_multi_info_read(multi, &queued))){
+    if(msg->msg == CURLMSG_DONE){
+      *easy = msg->easy_handle;
+      *result = (int)msg->data.result;
+      return 1;
+    }
+  }
+  return 0;
+}
+
+// A curl share handle, together with one lock for each kind of
+// data that can be shared, so that the share can be used by
+// handles on different threads.
+typedef struct {
+  CURLSH* share;
+  stz_mutex locks[CURL_LOCK_DATA_LAST];
+} stz_share;
+
+static void stz_share_lock (CURL* handle, curl_lock_data data, curl_lock_access access, void* userptr){
+  stz_share* s = (stz_share*)userptr;
+  stz_mutex_lock(&s->locks[data]);
+}
+
+static void stz_share_unlock (CURL* handle, curl_lock_data data, void* userptr){
+  stz_share* s = (stz_share*)userptr;
+  stz_mutex_unlock(&s->locks[data]);
+}
+
+// Create a share handle with lock callbacks installed.
+// Returns NULL if the share handle could not be created.
+stz_share* stz_share_init (){
+  stz_share* s = (stz_share*)malloc(sizeof(stz_share));
+  if(!s) return NULL;
+  s->share = curl_share_init();
+  if(!s->share){
+    free(s);
+    return NULL;
+  }
+  for(int i=0; i<CURL_LOCK_DATA_LAST; i++)
+    stz_mutex_init(&s->locks[i]);
+  curl_share_setopt(s->share, CURLSHOPT_LOCKFUNC, stz_share_lock);
+  curl_share_setopt(s->share, CURLSHOPT_UNLOCKFUNC, stz_share_unlock);
+  curl_share_setopt(s->share, CURLSHOPT_USERDATA, s);
+  return s;
+}
+
+CURLSH* stz_share_handle (stz_share* s){
+  return s->share;
+}
+
+// Share the given kind of data (CURL_LOCK_DATA_*) between the
+// handles that use the share.
+int stz_share_data (stz_share* s, long data){
+  return (int)curl_share_setopt(s->share, CURLSHOPT_SHARE, data);
+}
+
+// Returns a nonzero error code, and leaves the share intact,
+// if the share is still in use by a handle.
+int stz_share_cleanup (stz_share* s){
+  CURLSHcode ret = curl_share_cleanup(s->share);
+  if(ret != CURLSHE_OK)
+    return (int)ret;
+  for(int i=0; i<CURL_LOCK_DATA_LAST; i++)
+    stz_mutex_destroy(&s->locks[i]);
+  free(s);
+  return 0;
+}
+
+// Create an empty file, replacing any existing file.
+// Returns 0 on success.
+int stz_file_create (const char* path){
+  FILE* f = fopen(path, "wb");
+  if(!f) return -1;
+  return fclose(f) == 0 ? 0 : -1;
+}
+
+// Extend an existing file to at least the given size.
+// Returns 0 on success.
+int stz_file_preallocate (const char* path, long long size){
+  FILE* f = fopen(path, "r+b");
+  if(!f) return -1;
+  int ret = 0;
+  if(stz_fseek(f, 0, SEEK_END) != 0)
+    ret = -1;
+  else if(stz_ftell(f) < size)
+    if(stz_fseek(f, size - 1, SEEK_SET) != 0 || fputc(0, f) == EOF)
+      ret = -1;
+  if(fclose(f) != 0) ret = -1;
+  return ret;
+}
+
+// Copy the file, replacing any existing file at the destination.
+// Returns 0 on success.
+int stz_file_copy (const char* from, const char* to){
+  FILE* in = fopen(from, "rb");
+  if(!in) return -1;
+  FILE* out = fopen(to, "wb");
+  if(!out){
+    fclose(in);
+    return -1;
+  }
+  int ret = 0;
+  char buffer[65536];
+  size_t n;
+  while((n = fread(buffer, 1, sizeof(buffer), in)) > 0)
+    if(fwrite(buffer, 1, n, out) != n){
+      ret = -1;
+      break;
+    }
+  if(ferror(in)) ret = -1;
+  fclose(in);
+  if(fclose(out) != 0) ret = -1;
+  return ret;
+}
+
+// Returns the size of the file, or -1 if it cannot be opened.
+long long stz_file_size (const char* path){
+  FILE* f = fopen(path, "rb");
+  if(!f) return -1;
+  long long size = -1;
+  if(stz_fseek(f, 0, SEEK_END) == 0)
+    size = stz_ftell(f);
+  fclose(f);
+  return size;
+}
+
+// A file that receives the response body of a transfer, from a given
+// offset. If required_code is not zero, the first write checks the
+// status of the response, and aborts the transfer before anything is
+// written if it is not required_code.
+typedef struct {
+  FILE* file;
+  CURL* handle;
+  long required_code;
+  int rejected;
+} stz_segment_file;
+
+static size_t stz_segment_write (char* data, size_t size, size_t n, void* userp){
+  stz_segment_file* f = (stz_segment_file*)userp;
+  if(f->required_code){
+    long code = 0;
+    curl_easy_getinfo(f->handle, CURLINFO_RESPONSE_CODE, &code);
+    if(code != f->required_code){
+      f->rejected = 1;
+      return 0;
+    }
+    f->required_code = 0;
+  }
+  return fwrite(data, size, n, f->file);
+}
+
+// Open an existing file for writing at the given offset, without
+// truncating it, and direct the response body of the handle to it.
+// Returns NULL on failure.
+stz_segment_file* stz_segment_open (CURL* handle, const char* path, long long offset, long required_code){
+  stz_segment_file* f = (stz_segment_file*)malloc(sizeof(stz_segment_file));
+  if(!f) return NULL;
+  f->file = fopen(path, "r+b");
+  if(!f->file || stz_fseek(f->file, offset, SEEK_SET) != 0){
+    if(f->file) fclose(f->file);
+    free(f);
+    return NULL;
+  }
+  f->handle = handle;
+  f->required_code = required_code;
+  f->rejected = 0;
+  curl_easy_setopt(handle, CURLOPT_WRITEFUNCTION, stz_segment_write);
+  curl_easy_setopt(handle, CURLOPT_WRITEDATA, f);
+  return f;
+}
+
+long long stz_segment_position (stz_segment_file* f){
+  return stz_ftell(f->file);
+}
+
+// Returns 1 if the transfer was aborted because of its response status.
+int stz_segment_rejected (stz_segment_file* f){
+  return f->rejected;
+}
+
+int stz_segment_close (stz_segment_file* f){
+  int ret = fclose(f->file);
+  free(f);
+  return ret;
+}
+
+// The sockets that a multi handle is waiting on, and its timeout,
+// as reported by its socket and timer callbacks.
+typedef struct {
+  curl_socket_t socket;
+  int what;
+} stz_watch;
+
+typedef struct {
+  CURLM* multi;
+  stz_watch* watches;
+  int count;
+  int capacity;
+  // The monotonic time in milliseconds at which the multi handle
+  // times out, or -1 if it has no timeout.
+  long long deadline;
+} stz_events;
+
+// Returns the time of a monotonic clock in milliseconds.
+static long long stz_monotonic_ms (){
+  #ifdef PLATFORM_WINDOWS
+    return (long long)GetTickCount64();
+  #else
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return (long long)t.tv_sec * 1000 + t.tv_nsec / 1000000;
+  #endif
+}
+
+static int stz_events_socket_callback (CURL* easy, curl_socket_t socket, int what, void* userp, void* socketp){
+  stz_events* e = (stz_events*)userp;
+  int i = 0;
+  while(i < e->count && e->watches[i].socket != socket) i++;
+  if(what == CURL_POLL_REMOVE){
+    if(i < e->count)
+      e->watches[i] = e->watches[--e->count];
+    return 0;
+  }
+  if(i == e->count){
+    if(e->count == e->capacity){
+      int capacity = e->capacity * 2;
+      stz_watch* watches = (stz_watch*)realloc(e->watches, capacity * sizeof(stz_watch));
+      if(!watches) return -1;
+      e->watches = watches;
+      e->capacity = capacity;
+    }
+    e->watches[e->count++].socket = socket;
+  }
+  e->watches[i].what = what;
+  return 0;
+}
+
+static int stz_events_timer_callback (CURLM* multi, long timeout, void* userp){
+  stz_events* e = (stz_events*)userp;
+  // The timeout is relative to now, so it is stored as a deadline
+  e->deadline = timeout < 0 ? -1 : stz_monotonic_ms() + timeout;
+  return 0;
+}
+
+// Install socket and timer callbacks on the multi handle.
+// Returns NULL if the callbacks could not be installed.
+stz_events* stz_events_init (CURLM* multi){
+  stz_events* e = (stz_events*)malloc(sizeof(stz_events));
+  if(!e) return NULL;
+  e->multi = multi;
+  e->capacity = 16;
+  e->count = 0;
+  e->watches = (stz_watch*)malloc(e->capacity * sizeof(stz_watch));
+  e->deadline = -1;
+  if(!e->watches ||
+     curl_multi_setopt(multi, CURLMOPT_SOCKETFUNCTION, stz_events_socket_callback) ||
+     curl_multi_setopt(multi, CURLMOPT_SOCKETDATA, e) ||
+     curl_multi_setopt(multi, CURLMOPT_TIMERFUNCTION, stz_events_timer_callback) ||
+     curl_multi_setopt(multi, CURLMOPT_TIMERDATA, e)){
+    free(e->watches);
+    free(e);
+    return NULL;
+  }
+  return e;
+}
+
+// Detach the callbacks from the multi handle, and free the events.
+// Must be called before the multi handle is cleaned up, which may call
+// the socket callback for the connections that it closes.
+int stz_events_cleanup (stz_events* e){
+  curl_multi_setopt(e->multi, CURLMOPT_SOCKETFUNCTION, NULL);
+  curl_multi_setopt(e->multi, CURLMOPT_SOCKETDATA, NULL);
+  curl_multi_setopt(e->multi, CURLMOPT_TIMERFUNCTION, NULL);
+  curl_multi_setopt(e->multi, CURLMOPT_TIMERDATA, NULL);
+  free(e->watches);
+  free(e);
+  return 0;
+}
+
+int stz_events_count (stz_events* e){
+  return e->count;
+}
+
+long long stz_events_socket (stz_events* e, int i){
+  return (long long)e->watches[i].socket;
+}
+
+// Returns CURL_POLL_IN, CURL_POLL_OUT or CURL_POLL_INOUT.
+int stz_events_what (stz_events* e, int i){
+  return e->watches[i].what;
+}
+
+// Returns the number of milliseconds until the multi handle times out,
+// or -1 if it has no timeout.
+long long stz_events_timeout (stz_events* e){
+  if(e->deadline < 0) return -1;
+  long long remaining = e->deadline - stz_monotonic_ms();
+  return remaining > 0 ? remaining : 0;
+}
+
+// Report activity on a socket to the multi handle.
+int stz_events_socket_action (stz_events* e, long long socket, int readable, int writable){
+  int running;
+  int mask = (readable ? CURL_CSELECT_IN : 0) | (writable ? CURL_CSELECT_OUT : 0);
+  return (int)curl_multi_socket_action(e->multi, (curl_socket_t)socket, mask, &running);
+}
+
+// Report that the timeout of the multi handle has expired.
+int stz_events_timeout_action (stz_events* e){
+  int running;
+  return (int)curl_multi_socket_action(e->multi, CURL_SOCKET_TIMEOUT, 0, &running);
+}
+
+// Wait with poll() until there is activity on a socket, or until the
+// timeout of the multi handle expires, but no longer than max_wait
+// milliseconds. Reports the activity to the multi handle.
+// Returns a CURLMcode, or -1 if poll() or the allocation of its
+// descriptors failed.
+int stz_events_wait (stz_events* e, int max_wait){
+  int count = e->count;
+  long long wait = stz_events_timeout(e);
+  if(wait < 0 || wait > max_wait) wait = max_wait;
+  stz_pollfd* fds = (stz_pollfd*)malloc((count > 0 ? count : 1) * sizeof(stz_pollfd));
+  if(!fds) return -1;
+  for(int i=0; i<count; i++){
+    fds[i].fd = e->watches[i].socket;
+    fds[i].events = ((e->watches[i].what & CURL_POLL_IN) ? POLLIN : 0) |
+                    ((e->watches[i].what & CURL_POLL_OUT) ? POLLOUT : 0);
+    fds[i].revents = 0;
+  }
+  int ready = 0;
+  if(count > 0)
+    ready = stz_poll(fds, count, (int)wait);
+  else if(wait > 0){
+    #ifdef PLATFORM_WINDOWS
+      Sleep((DWORD)wait);
+    #else
+      poll(NULL, 0, (int)wait);
+    #endif
+  }
+  int ret = 0;
+  if(ready < 0)
+    ret = -1;
+  else if(ready == 0)
+    ret = stz_events_timeout_action(e);
+  else
+    for(int i=0; i<count && ret == 0; i++){
+      short revents = fds[i].revents;
+      if(revents)
+        ret = stz_events_socket_action(e, (long long)fds[i].fd,
+                                       revents & (POLLIN | POLLHUP | POLLERR),
+                                       revents & (POLLOUT | POLLERR));
+    }
+  free(fds);
+  return ret;
+}
@@ -0,0 +1,573 @@
+// A minimal HTTP/1.1 server on the loopback interface, used as a
+// stand-in for a real server by the benchmarks.
+//
+// GET /bytes/N responds with a body of N bytes, the repeated hex digits
+// "0123456789abcdef", or with the part of it named by a Range header.
+// HEAD /bytes/N responds with the headers of GET /bytes/N.
+// /fresh/N, /etag/N and /modified/N respond as /bytes/N, with caching
+// headers: /fresh/N is fresh for an hour, /etag/N and /modified/N must
+// be revalidated, and respond with 304 Not Modified to a request with
+// their ETag in If-None-Match or their Last-Modified in If-Modified-Since.
+// /norange/N responds as /bytes/N, but ignores Range headers although it
+// advertises Accept-Ranges, and /stream/N ignores them without
+// advertising it.
+// GET /gzip responds with the first 10000 bytes of the repeated hex
+// digits, gzip encoded if the request accepts it.
+// POST /echo responds with the request body. Other POST requests read
+// and discard the request body, and respond with "ok". Request bodies
+// are either sized by Content-Length or sent with chunked
+// Transfer-Encoding, and Expect: 100-continue is answered.
+// Connections are kept alive, and each one is served by its own thread.
+// Connections that start with the HTTP/2 preface (prior knowledge) are
+// served with HTTP/2, which answers every request with the first 100
+// bytes of the body, whatever its path, and counts the connections.
+
+#include <curl/curl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <pthread.h>
+#include <unistd.h>
+#include <strings.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+#include <arpa/inet.h>
+#include <sys/socket.h>
+#include <sys/resource.h>
+#ifdef __APPLE__
+  #include <mach/mach.h>
+#endif
+
+#define REQUEST_BUFFER_SIZE 65536
+#define BODY_CHUNK_SIZE 65536
+#define BODY_PATTERN "0123456789abcdef"
+#define BODY_PATTERN_SIZE 16
+#define LAST_MODIFIED "Mon, 01 Jan 2024 00:00:00 GMT"
+
+// The gzip encoding of the GET /gzip body.
+#define GZIP_BODY_SIZE 10000
+static const unsigned char gzip_body[] = {
+  0x1f, 0x8b, 0x08, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02, 0x03, 0xed, 0xc7,
+  0xdb, 0x11, 0xc0, 0x10, 0x00, 0x00, 0xb0, 0x95, 0x94, 0x7a, 0x8d, 0x83,
+  0xb2, 0xff, 0x08, 0x9d, 0xc3, 0x5d, 0xf2, 0x97, 0xf0, 0xc4, 0xf4, 0xe6,
+  0x52, 0x5b, 0x1f, 0x73, 0x7d, 0xfb, 0x04, 0x77, 0x77, 0x77, 0x77, 0x77,
+  0x77, 0x77, 0x77, 0x77, 0x77, 0x77, 0x77, 0x77, 0x77, 0x77, 0x77, 0x77,
+  0x77, 0xf7, 0x0b, 0xff, 0x03, 0x78, 0x76, 0x63, 0x47, 0x10, 0x27, 0x00,
+  0x00
+};
+
+// The size of the body of HTTP/2 responses.
+#define H2_BODY_SIZE 100
+#define H2_PREFACE "PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+#define H2_PREFACE_SIZE 24
+#define H2_MAX_FRAME_SIZE 16384
+#define H2_DATA 0
+#define H2_HEADERS 1
+#define H2_SETTINGS 4
+#define H2_PING 6
+#define H2_GOAWAY 7
+#define H2_FLAG_END_STREAM 1
+#define H2_FLAG_ACK 1
+#define H2_FLAG_END_HEADERS 4
+
+static int server_socket = -1;
+static pthread_t accept_thread;
+static char body_chunk[BODY_CHUNK_SIZE + BODY_PATTERN_SIZE];
+
+static int write_all (int fd, const char* data, long long n){
+  while(n > 0){
+    ssize_t written = send(fd, data, (size_t)(n < BODY_CHUNK_SIZE ? n : BODY_CHUNK_SIZE), 0);
+    if(written <= 0) return -1;
+    data += written;
+    n -= written;
+  }
+  return 0;
+}
+
+// Write the n bytes of the body starting at the given offset.
+static int write_body (int fd, long long offset, long long n){
+  const char* chunk_start = body_chunk + offset % BODY_PATTERN_SIZE;
+  while(n > 0){
+    long long chunk = n < BODY_CHUNK_SIZE ? n : BODY_CHUNK_SIZE;
+    if(write_all(fd, chunk_start, chunk)) return -1;
+    n -= chunk;
+  }
+  return 0;
+}
+
+// Returns the value of the given request header, or NULL if absent.
+static const char* find_header (const char* headers, const char* name){
+  size_t name_length = strlen(name);
+  const char* line = headers;
+  while((line = strstr(line, "\r\n"))){
+    line += 2;
+    if(strncasecmp(line, name, name_length) == 0 && line[name_length] == ':'){
+      const char* value = line + name_length + 1;
+      while(*value == ' ') value++;
+      return value;
+    }
+  }
+  return NULL;
+}
+
+// Returns the value of the Content-Length header, or 0 if absent.
+static long long content_length (const char* headers){
+  const char* value = find_header(headers, "Content-Length");
+  return value ? atoll(value) : 0;
+}
+
+// Returns 1 if the value of the request header is the given string.
+static int header_equals (const char* headers, const char* name, const char* value){
+  const char* v = find_header(headers, name);
+  size_t n = strlen(value);
+  return v && strncmp(v, value, n) == 0 && v[n] == '\r';
+}
+
+// The request body, which starts with the bytes that were received
+// with the request headers.
+typedef struct {
+  int fd;
+  char* buffered;
+  int buffered_length;
+} body_reader;
+
+// Read up to n bytes of the request body. Returns the number of bytes
+// read, or -1 if the connection is closed.
+static long long read_some (body_reader* r, char* data, long long n){
+  if(r->buffered_length > 0){
+    int k = n < r->buffered_length ? (int)n : r->buffered_length;
+    memcpy(data, r->buffered, k);
+    r->buffered += k;
+    r->buffered_length -= k;
+    return k;
+  }
+  ssize_t k = recv(r->fd, data, (size_t)(n < BODY_CHUNK_SIZE ? n : BODY_CHUNK_SIZE), 0);
+  return k > 0 ? k : -1;
+}
+
+// A growing buffer for the body of POST /echo.
+typedef struct {
+  char* data;
+  long long length;
+  long long capacity;
+} echo_buffer;
+
+// Read n bytes of the request body into the echo buffer, or discard
+// them if there is no echo buffer.
+static int read_exactly (body_reader* r, long long n, echo_buffer* echo, char* discard){
+  if(echo && echo->length + n > echo->capacity){
+    long long capacity = echo->capacity * 2 > echo->length + n ? echo->capacity * 2 : echo->length + n;
+    char* data = (char*)realloc(echo->data, (size_t)capacity);
+    if(!data) return -1;
+    echo->data = data;
+    echo->capacity = capacity;
+  }
+  while(n > 0){
+    char* data = echo ? echo->data + echo->length : discard;
+    long long k = read_some(r, data, echo ? n : (n < BODY_CHUNK_SIZE ? n : BODY_CHUNK_SIZE));
+    if(k < 0) return -1;
+    if(echo) echo->length += k;
+    n -= k;
+  }
+  return 0;
+}
+
+// Read exactly n bytes.
+static int read_full (body_reader* r, char* data, long long n){
+  while(n > 0){
+    long long k = read_some(r, data, n);
+    if(k < 0) return -1;
+    data += k;
+    n -= k;
+  }
+  return 0;
+}
+
+// Read a CRLF terminated line of the request body, without the CRLF.
+static int read_line (body_reader* r, char* line, int size){
+  int n = 0;
+  for(;;){
+    char c;
+    if(read_some(r, &c, 1) < 0) return -1;
+    if(c == '\n') break;
+    if(n < size - 1 && c != '\r') line[n++] = c;
+  }
+  line[n] = 0;
+  return 0;
+}
+
+// Read the request body, decoding chunked Transfer-Encoding, into the
+// echo buffer, or discard it if there is no echo buffer.
+static int read_body (body_reader* r, const char* headers, echo_buffer* echo, char* discard){
+  if(!header_equals(headers, "Transfer-Encoding", "chunked"))
+    return read_exactly(r, content_length(headers), echo, discard);
+  char line[256];
+  for(;;){
+    if(read_line(r, line, sizeof(line))) return -1;
+    long long size = strtoll(line, NULL, 16);
+    if(size == 0) break;
+    if(read_exactly(r, size, echo, discard) || read_line(r, line, sizeof(line))) return -1;
+  }
+  // Skip the trailer
+  do{
+    if(read_line(r, line, sizeof(line))) return -1;
+  } while(line[0]);
+  return 0;
+}
+
+// Returns 1 if the comma-separated value of the request header
+// contains the given token.
+static int header_contains (const char* headers, const char* name, const char* token){
+  const char* v = find_header(headers, name);
+  if(!v) return 0;
+  const char* end = strstr(v, "\r\n");
+  size_t n = strlen(token);
+  for(const char* t = strstr(v, token); t && t < end; t = strstr(t + 1, token))
+    if((t == v || t[-1] == ' ' || t[-1] == ',') &&
+       (t[n] == ',' || t[n] == ';' || t[n] == ' ' || t[n] == '\r'))
+      return 1;
+  return 0;
+}
+
+// How a body resource treats Range headers.
+#define RANGES_HONORED 0
+#define RANGES_IGNORED 1
+#define RANGES_UNADVERTISED 2
+
+// Parse the path of a body resource, and return its size, its caching
+// headers, whether the request is answered with 304 Not Modified, and
+// how it treats Range headers.
+// Returns 0 if the path is not a body resource.
+static int parse_body_path (const char* request, const char* path, long long* size,
+                            char* cache_headers, size_t cache_headers_size, int* not_modified,
+                            int* ranges){
+  *not_modified = 0;
+  *ranges = RANGES_HONORED;
+  cache_headers[0] = 0;
+  if(strncmp(path, "/bytes/", 7) == 0){
+    *size = atoll(path + 7);
+  }
+  else if(strncmp(path, "/norange/", 9) == 0){
+    *size = atoll(path + 9);
+    *ranges = RANGES_IGNORED;
+  }
+  else if(strncmp(path, "/stream/", 8) == 0){
+    *size = atoll(path + 8);
+    *ranges = RANGES_UNADVERTISED;
+  }
+  else if(strncmp(path, "/fresh/", 7) == 0){
+    *size = atoll(path + 7);
+    snprintf(cache_headers, cache_headers_size, "Cache-Control: max-age=3600\r\n");
+  }
+  else if(strncmp(path, "/etag/", 6) == 0){
+    *size = atoll(path + 6);
+    char etag[32];
+    snprintf(etag, sizeof(etag), "\"etag-%lld\"", *size);
+    snprintf(cache_headers, cache_headers_size, "Cache-Control: no-cache\r\nETag: %s\r\n", etag);
+    *not_modified = header_equals(request, "If-None-Match", etag);
+  }
+  else if(strncmp(path, "/modified/", 10) == 0){
+    *size = atoll(path + 10);
+    snprintf(cache_headers, cache_headers_size,
+             "Cache-Control: no-cache\r\nLast-Modified: " LAST_MODIFIED "\r\n");
+    *not_modified = header_equals(request, "If-Modified-Since", LAST_MODIFIED);
+  }
+  else
+    return 0;
+  return 1;
+}
+
+// Parse a "Range: bytes=first-[last]" header for a body of the given size.
+// Returns 1 and the bounds of the range if there is a satisfiable range.
+static int parse_range (const char* headers, long long size, long long* first, long long* last){
+  const char* value = find_header(headers, "Range");
+  if(!value || strncmp(value, "bytes=", 6)) return 0;
+  char* end;
+  *first = strtoll(value + 6, &end, 10);
+  if(end == value + 6 || *end != '-') return 0;
+  *last = end[1] >= '0' && end[1] <= '9' ? atoll(end + 1) : size - 1;
+  if(*last >= size) *last = size - 1;
+  return *first <= *last;
+}
+
+// The number of HTTP/2 connections that have been served.
+static long long h2_connections = 0;
+
+// Write the header of an HTTP/2 frame, followed by its payload.
+static int write_h2_frame (int fd, int type, int flags, unsigned int stream,
+                           const char* payload, int length){
+  unsigned char header[9] = {
+    (unsigned char)(length >> 16), (unsigned char)(length >> 8), (unsigned char)length,
+    (unsigned char)type, (unsigned char)flags,
+    (unsigned char)(stream >> 24), (unsigned char)(stream >> 16),
+    (unsigned char)(stream >> 8), (unsigned char)stream};
+  if(write_all(fd, (const char*)header, 9)) return -1;
+  return length > 0 ? write_all(fd, payload, length) : 0;
+}
+
+// Serve an HTTP/2 connection whose preface has been read. The request
+// headers are not decoded: each stream whose headers end the stream is
+// answered with a 200 response and H2_BODY_SIZE bytes of the body.
+static void serve_h2 (body_reader* r){
+  __atomic_add_fetch(&h2_connections, 1, __ATOMIC_RELAXED);
+  char* payload = (char*)malloc(H2_MAX_FRAME_SIZE);
+  // The server preface, with the default settings
+  if(!payload || write_h2_frame(r->fd, H2_SETTINGS, 0, 0, NULL, 0)) goto done;
+  for(;;){
+    unsigned char header[9];
+    if(read_full(r, (char*)header, 9)) goto done;
+    int length = header[0] << 16 | header[1] << 8 | header[2];
+    int type = header[3], flags = header[4];
+    unsigned int stream = (header[5] & 0x7fu) << 24 | header[6] << 16 | header[7] << 8 | header[8];
+    if(length > H2_MAX_FRAME_SIZE || read_full(r, payload, length)) goto done;
+    if(type == H2_SETTINGS && !(flags & H2_FLAG_ACK)){
+      if(write_h2_frame(r->fd, H2_SETTINGS, H2_FLAG_ACK, 0, NULL, 0)) goto done;
+    }
+    else if(type == H2_PING && !(flags & H2_FLAG_ACK)){
+      if(write_h2_frame(r->fd, H2_PING, H2_FLAG_ACK, 0, payload, length)) goto done;
+    }
+    else if(type == H2_HEADERS && (flags & H2_FLAG_END_STREAM)){
+      // 0x88 is the HPACK static table entry of ":status: 200"
+      if(write_h2_frame(r->fd, H2_HEADERS, H2_FLAG_END_HEADERS, stream, "\x88", 1) ||
+         write_h2_frame(r->fd, H2_DATA, H2_FLAG_END_STREAM, stream, body_chunk, H2_BODY_SIZE))
+        goto done;
+    }
+    else if(type == H2_GOAWAY)
+      goto done;
+  }
+done:
+  free(payload);
+}
+
+static void* serve_connection (void* arg){
+  int fd = (int)(long)arg;
+  char* buffer = (char*)malloc(REQUEST_BUFFER_SIZE + 1);
+  char* discard = (char*)malloc(BODY_CHUNK_SIZE);
+  echo_buffer echo_body = {NULL, 0, 0};
+  int length = 0;
+  for(;;){
+    // Read until the end of the request headers
+    char* end;
+    buffer[length] = 0;
+    while(!(end = strstr(buffer, "\r\n\r\n"))){
+      if(length == REQUEST_BUFFER_SIZE) goto done;
+      ssize_t n = recv(fd, buffer + length, REQUEST_BUFFER_SIZE - length, 0);
+      if(n <= 0) goto done;
+      length += (int)n;
+      buffer[length] = 0;
+    }
+    int header_length = (int)(end - buffer) + 4;
+    if(strncmp(buffer, H2_PREFACE, header_length) == 0){
+      // The rest of the preface follows the blank line of its request line
+      body_reader reader = {fd, buffer + header_length, length - header_length};
+      char rest[H2_PREFACE_SIZE];
+      int rest_length = H2_PREFACE_SIZE - header_length;
+      if(read_full(&reader, rest, rest_length) ||
+         memcmp(rest, H2_PREFACE + header_length, rest_length))
+        goto done;
+      serve_h2(&reader);
+      goto done;
+    }
+    int get = strncmp(buffer, "GET ", 4) == 0;
+    int head = strncmp(buffer, "HEAD ", 5) == 0;
+    int echo = strncmp(buffer, "POST /echo ", 11) == 0;
+    char header[512];
+    int n;
+
+    // Read the request body
+    if(header_equals(buffer, "Expect", "100-continue")){
+      n = snprintf(header, sizeof(header), "HTTP/1.1 100 Continue\r\n\r\n");
+      if(write_all(fd, header, n)) goto done;
+    }
+    body_reader reader = {fd, buffer + header_length, length - header_length};
+    echo_body.length = 0;
+    if(read_body(&reader, buffer, echo ? &echo_body : NULL, discard)) goto done;
+
+    // Respond
+    char cache_headers[128];
+    long long size;
+    int not_modified, ranges;
+    if((get || head) &&
+       parse_body_path(buffer, buffer + (get ? 4 : 5), &size,
+                       cache_headers, sizeof(cache_headers), &not_modified, &ranges)){
+      long long first = 0, last = size - 1;
+      const char* accept_ranges = ranges == RANGES_UNADVERTISED ? "" : "Accept-Ranges: bytes\r\n";
+      if(not_modified){
+        n = snprintf(header, sizeof(header),
+                     "HTTP/1.1 304 Not Modified\r\n%sConnection: keep-alive\r\n\r\n",
+                     cache_headers);
+        get = 0;
+      }
+      else if(ranges == RANGES_HONORED && parse_range(buffer, size, &first, &last))
+        n = snprintf(header, sizeof(header),
+                     "HTTP/1.1 206 Partial Content\r\nContent-Length: %lld\r\n"
+                     "Content-Range: bytes %lld-%lld/%lld\r\nAccept-Ranges: bytes\r\n"
+                     "%sConnection: keep-alive\r\n\r\n",
+                     last - first + 1, first, last, size, cache_headers);
+      else
+        n = snprintf(header, sizeof(header),
+                     "HTTP/1.1 200 OK\r\nContent-Length: %lld\r\n%s"
+                     "%sConnection: keep-alive\r\n\r\n", size, accept_ranges, cache_headers);
+      if(write_all(fd, header, n)) goto done;
+      if(get && write_body(fd, first, last - first + 1)) goto done;
+    }
+    else if(get && strncmp(buffer + 4, "/gzip ", 6) == 0){
+      if(header_contains(buffer, "Accept-Encoding", "gzip")){
+        n = snprintf(header, sizeof(header),
+                     "HTTP/1.1 200 OK\r\nContent-Length: %d\r\nContent-Encoding: gzip\r\n"
+                     "Connection: keep-alive\r\n\r\n", (int)sizeof(gzip_body));
+        if(write_all(fd, header, n)) goto done;
+        if(write_all(fd, (const char*)gzip_body, sizeof(gzip_body))) goto done;
+      }
+      else{
+        n = snprintf(header, sizeof(header),
+                     "HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: keep-alive\r\n\r\n",
+                     GZIP_BODY_SIZE);
+        if(write_all(fd, header, n)) goto done;
+        if(write_body(fd, 0, GZIP_BODY_SIZE)) goto done;
+      }
+    }
+    else if(echo){
+      n = snprintf(header, sizeof(header),
+                   "HTTP/1.1 200 OK\r\nContent-Length: %lld\r\nConnection: keep-alive\r\n\r\n",
+                   echo_body.length);
+      if(write_all(fd, header, n)) goto done;
+      if(write_all(fd, echo_body.data, echo_body.length)) goto done;
+    }
+    else{
+      n = snprintf(header, sizeof(header),
+                   "HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\n");
+      if(write_all(fd, header, n)) goto done;
+      if(write_all(fd, "ok", 2)) goto done;
+    }
+
+    // Keep any pipelined data for the next request
+    memmove(buffer, reader.buffered, reader.buffered_length);
+    length = reader.buffered_length;
+  }
+done:
+  free(buffer);
+  free(discard);
+  free(echo_body.data);
+  close(fd);
+  return NULL;
+}
+
+static void* accept_connections (void* arg){
+  for(;;){
+    int fd = accept(server_socket, NULL, NULL);
+    if(fd < 0) return NULL;
+    int one = 1;
+    setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, &one, sizeof(one));
+    pthread_t thread;
+    if(pthread_create(&thread, NULL, serve_connection, (void*)(long)fd) == 0)
+      pthread_detach(thread);
+    else
+      close(fd);
+  }
+}
+
+// Start the server on an ephemeral port of 127.0.0.1.
+// Returns the port, or -1 if the server could not be started.
+int stz_bench_server_start (){
+  for(int i = 0; i < BODY_CHUNK_SIZE + BODY_PATTERN_SIZE; i++)
+    body_chunk[i] = BODY_PATTERN[i % BODY_PATTERN_SIZE];
+  server_socket = socket(AF_INET, SOCK_STREAM, 0);
+  if(server_socket < 0) return -1;
+  struct sockaddr_in address;
+  memset(&address, 0, sizeof(address));
+  address.sin_family = AF_INET;
+  address.sin_addr.s_addr = htonl(INADDR_LOOPBACK);
+  address.sin_port = 0;
+  socklen_t address_length = sizeof(address);
+  if(bind(server_socket, (struct sockaddr*)&address, sizeof(address)) ||
+     listen(server_socket, 128) ||
+     getsockname(server_socket, (struct sockaddr*)&address, &address_length) ||
+     pthread_create(&accept_thread, NULL, accept_connections, NULL)){
+    close(server_socket);
+    return -1;
+  }
+  return ntohs(address.sin_port);
+}
+
+// Stop accepting connections.
+int stz_bench_server_stop (){
+  shutdown(server_socket, SHUT_RDWR);
+  close(server_socket);
+  pthread_join(accept_thread, NULL);
+  return 0;
+}
+
+// Returns the number of HTTP/2 connections that have been served.
+long long stz_bench_server_h2_connections (){
+  return __atomic_load_n(&h2_connections, __ATOMIC_RELAXED);
+}
+
+// Returns the peak resident set size of the process in kilobytes.
+long long stz_bench_peak_rss_kb (){
+  struct rusage usage;
+  getrusage(RUSAGE_SELF, &usage);
+  #ifdef __APPLE__
+    return usage.ru_maxrss / 1024;
+  #else
+    return usage.ru_maxrss;
+  #endif
+}
+
+// Returns the current resident set size of the process in kilobytes,
+// or -1 if it is not known on this platform.
+long long stz_bench_current_rss_kb (){
+  #if defined(__APPLE__)
+    mach_task_basic_info_data_t info;
+    mach_msg_type_number_t count = MACH_TASK_BASIC_INFO_COUNT;
+    if(task_info(mach_task_self(), MACH_TASK_BASIC_INFO, (task_info_t)&info, &count) != KERN_SUCCESS)
+      return -1;
+    return info.resident_size / 1024;
+  #elif defined(__linux__)
+    FILE* file = fopen("/proc/self/statm", "r");
+    if(file == NULL)
+      return -1;
+    long long size, resident;
+    int n = fscanf(file, "%lld %lld", &size, &resident);
+    fclose(file);
+    if(n != 2)
+      return -1;
+    return resident * (sysconf(_SC_PAGESIZE) / 1024);
+  #else
+    return -1;
+  #endif
+}
+
+// The number of heap allocations made by libcurl.
+static long long allocations = 0;
+
+static void* counting_malloc (size_t size){
+  __atomic_add_fetch(&allocations, 1, __ATOMIC_RELAXED);
+  return malloc(size);
+}
+
+static void* counting_realloc (void* p, size_t size){
+  __atomic_add_fetch(&allocations, 1, __ATOMIC_RELAXED);
+  return realloc(p, size);
+}
+
+static char* counting_strdup (const char* s){
+  __atomic_add_fetch(&allocations, 1, __ATOMIC_RELAXED);
+  return strdup(s);
+}
+
+static void* counting_calloc (size_t n, size_t size){
+  __atomic_add_fetch(&allocations, 1, __ATOMIC_RELAXED);
+  return calloc(n, size);
+}
+
+// Count the heap allocations made by libcurl. Must be called before
+// curl is initialized.
+int stz_bench_count_allocations (){
+  return (int)curl_global_init_mem(CURL_GLOBAL_ALL, counting_malloc, free,
+                                   counting_realloc, counting_strdup, counting_calloc);
+}
+
+long long stz_bench_allocations (){
+  return __atomic_load_n(&allocations, __ATOMIC_RELAXED);
+}